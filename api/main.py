@@ -1,12 +1,17 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from pathlib import Path
 from typing import List
+import asyncio
+import hashlib
+import io
+import os
+import re
 import uuid
 import logging
 
-from screenshot_processor import ScreenshotProcessor
+from screenshot_processor import OCR_POOL, SUPPORTED_FORMATS, ScreenshotProcessor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,7 +19,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Screenshot to Docs API",
     description="API for converting screenshots to Word documents",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -23,15 +29,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "X-File-Id", "X-Processed-Count"],
 )
 
-UPLOAD_DIR = Path("/app/uploads")
 OUTPUT_DIR = Path("/app/outputs")
-UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+MAX_UPLOAD_SIZE = 50 << 20
+MAX_REQUEST_SIZE = 200 << 20
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+FILE_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+
 processor = ScreenshotProcessor()
 
+def _write_cache(cache_path: Path, content: bytes) -> None:
+    tmp_path = cache_path.with_name(f"{cache_path.stem}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, cache_path)
+
+def _validate_upload(file: UploadFile) -> None:
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail=f"File {file.filename} must be an image")
+
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="Filename is required")
+
+    if Path(file.filename).suffix.lower() not in SUPPORTED_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {file.filename}")
+
 @app.get("/")
 async def root():
     return {"message": "Screenshot to Docs API is running"}
@@ -41,64 +67,81 @@ async def process_screenshots(files: List[UploadFile] = File(...)):
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
 
-    file_id = str(uuid.uuid4())
-    upload_paths = []
+    images = []
+    digests = []
+    total_size = 0
 
     try:
         for file in files:
-            if not file.content_type or not file.content_type.startswith("image/"):
-                raise HTTPException(status_code=400, detail=f"File {file.filename} must be an image")
-
-            if not file.filename:
-                raise HTTPException(status_code=400, detail="Filename is required")
-
-            file_extension = Path(file.filename).suffix.lower()
-            if file_extension not in {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'}:
-                raise HTTPException(status_code=400, detail=f"Unsupported format: {file.filename}")
-
-            upload_path = UPLOAD_DIR / f"{file_id}_{len(upload_paths)}{file_extension}"
-            upload_path.write_bytes(await file.read())
-            upload_paths.append(upload_path)
-            logger.info(f"Uploaded: {upload_path}")
-
-        output_path = OUTPUT_DIR / f"{file_id}.docx"
-        processor.process_images([str(p) for p in upload_paths], str(output_path))
-        logger.info(f"Generated: {output_path}")
-
-        return {
-            "success": True,
-            "file_id": file_id,
-            "processed_count": len(upload_paths),
-            "download_url": f"/download/{file_id}"
-        }
+            _validate_upload(file)
+
+            buffer = bytearray()
+            file_hash = hashlib.sha256()
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                total_size += len(chunk)
+                if len(buffer) + len(chunk) > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=413, detail=f"File {file.filename} is too large")
+                if total_size > MAX_REQUEST_SIZE:
+                    raise HTTPException(status_code=413, detail="Upload exceeds the total size limit")
+                file_hash.update(chunk)
+                buffer += chunk
+            images.append(buffer)
+            digests.append(file_hash.hexdigest())
+            logger.info(f"Uploaded: {file.filename} ({len(buffer)} bytes)")
+
+        cache_source = f"{processor.PIPELINE_VERSION}:" + ''.join(digests)
+        file_id = hashlib.sha256(cache_source.encode()).hexdigest()
+        cache_path = OUTPUT_DIR / f"{file_id}.docx"
+        filename = f"extracted_content_{file_id}.docx"
+        headers = {"X-File-Id": file_id, "X-Processed-Count": str(len(images))}
+
+        if await asyncio.to_thread(cache_path.exists):
+            logger.info(f"Cache hit: {cache_path}")
+            return FileResponse(path=cache_path, filename=filename,
+                                media_type=DOCX_MEDIA_TYPE, headers=headers)
+
+        output = io.BytesIO()
+        if len(images) == 1:
+            await asyncio.get_running_loop().run_in_executor(
+                OCR_POOL, processor.process_image, images[0], output
+            )
+        else:
+            await asyncio.to_thread(processor.process_images, images, output)
+        logger.info(f"Generated: {file_id}")
+
+        await asyncio.to_thread(_write_cache, cache_path, output.getvalue())
+
+        return FileResponse(path=cache_path, filename=filename,
+                            media_type=DOCX_MEDIA_TYPE, headers=headers)
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to process screenshots: {str(e)}")
-    finally:
-        for upload_path in upload_paths:
-            if upload_path.exists():
-                upload_path.unlink(missing_ok=True)
 
 @app.get("/download/{file_id}")
 async def download_file(file_id: str):
-    try:
-        uuid.UUID(file_id)
-    except ValueError:
+    if not FILE_ID_PATTERN.fullmatch(file_id):
         raise HTTPException(status_code=400, detail="Invalid file ID format")
 
     file_path = OUTPUT_DIR / f"{file_id}.docx"
-    if not file_path.exists():
+    if not await asyncio.to_thread(file_path.exists):
         raise HTTPException(status_code=404, detail="File not found")
 
     return FileResponse(
         path=file_path,
         filename=f"extracted_content_{file_id}.docx",
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        media_type=DOCX_MEDIA_TYPE
     )
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.setdefault("WEB_CONCURRENCY", "4"))
+    )
@@ -1,44 +1,89 @@
 import logging
-from typing import List, Dict
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, List, Dict, Union
+
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
 
 import cv2
 import numpy as np
-import pytesseract
+from tesserocr import OEM, PSM, RIL, PyTessBaseAPI, iterate_level
 from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+from docx.oxml.ns import qn
 from docx.shared import Pt, Inches, RGBColor
+from lxml import etree
 
 logger = logging.getLogger(__name__)
 
+_WEB_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+OCR_POOL = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 1) // _WEB_WORKERS))
+_TESS_LOCAL = threading.local()
+
+SUPPORTED_FORMATS = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'})
+
+STYLE_BODY = 0
+STYLE_HEADING1 = 1
+STYLE_HEADING2 = 2
+STYLE_HEADING3 = 3
+STYLE_HEADER = 4
+
+_W_P = qn('w:p')
+_W_PPR = qn('w:pPr')
+_W_PSTYLE = qn('w:pStyle')
+_W_SPACING = qn('w:spacing')
+_W_R = qn('w:r')
+_W_RPR = qn('w:rPr')
+_W_SZ = qn('w:sz')
+_W_T = qn('w:t')
+_W_BR = qn('w:br')
+_W_VAL = qn('w:val')
+_W_BEFORE = qn('w:before')
+_W_TYPE = qn('w:type')
+
+_PT = {n: Pt(n) for n in (0, 4, 6, 8, 9, 11)}
+_BLACK = RGBColor(0, 0, 0)
+_GREY = RGBColor(150, 150, 150)
+_MARGIN_VERTICAL = Inches(0.8)
+_MARGIN_HORIZONTAL = Inches(1.0)
+
+
+def _tess_api() -> PyTessBaseAPI:
+    api = getattr(_TESS_LOCAL, 'api', None)
+    if api is None:
+        api = PyTessBaseAPI(lang='eng', psm=PSM.SINGLE_BLOCK, oem=OEM.LSTM_ONLY)
+        _TESS_LOCAL.api = api
+    return api
+
 
 class ScreenshotProcessor:
+    PIPELINE_VERSION = 2
     CONFIDENCE_THRESHOLD = 30
-    SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'}
-
-    def __init__(self):
-        self.font_size_thresholds = {
-            'heading1': 22,
-            'heading2': 18,
-            'heading3': 14,
-            'body': 11
-        }
-
-    def process_image(self, image_path: str, output_path: str) -> None:
-        self.process_images([image_path], output_path)
-
-    def process_images(self, image_paths: List[str], output_path: str) -> None:
-        logger.info(f"Processing {len(image_paths)} images")
-
+    LINE_BREAK_THRESHOLD = 10
+    MAX_OCR_EDGE = 2400
+    THRESHOLD_BLOCK_SIZE = 31
+    THRESHOLD_OFFSET = 10
+    SUPPORTED_FORMATS = SUPPORTED_FORMATS
+    H1 = 22
+    H2 = 18
+    H3 = 14
+
+    def process_image(self, image: Union[bytes, bytearray], output: Union[str, BinaryIO]) -> None:
+        text_blocks = self.extract_text_with_layout(self._decode_image(image, 0))
+        logger.info(f"Extracted {len(text_blocks)} blocks from image 1")
+
+        self.create_word_document(text_blocks, output)
+        logger.info(f"Created document with {len(text_blocks)} blocks")
+
+    def process_images(self, images: List[Union[bytes, bytearray]], output: Union[str, BinaryIO]) -> None:
+        logger.info(f"Processing {len(images)} images")
+
+        imgs = [self._decode_image(image, idx) for idx, image in enumerate(images)]
         all_text_blocks = []
 
-        for idx, image_path in enumerate(image_paths):
-            logger.info(f"Processing image {idx + 1}/{len(image_paths)}: {image_path}")
-
-            img = cv2.imread(image_path)
-            if img is None:
-                raise ValueError(f"Could not read image: {image_path}")
-
-            text_blocks = self.extract_text_with_layout(img)
+        for idx, text_blocks in enumerate(self.extract_text_batch(imgs)):
             logger.info(f"Extracted {len(text_blocks)} blocks from image {idx + 1}")
 
             if idx > 0 and text_blocks:
@@ -47,177 +92,234 @@ class ScreenshotProcessor:
             all_text_blocks.extend(text_blocks)
 
         logger.info(f"Total blocks extracted: {len(all_text_blocks)}")
-        self.create_word_document(all_text_blocks, output_path)
-        logger.info(f"Created: {output_path}")
-
-    def extract_text_with_layout(self, img: np.ndarray) -> List[Dict]:
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        data = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
+        self.create_word_document(all_text_blocks, output)
+        logger.info(f"Created document with {len(all_text_blocks)} blocks")
+
+    def _decode_image(self, image: Union[bytes, bytearray], idx: int) -> np.ndarray:
+        gray = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError(f"Could not decode image {idx + 1}")
+        return gray
+
+    def extract_text_batch(self, grays: List[np.ndarray]) -> List[List[Dict]]:
+        return list(OCR_POOL.map(self.extract_text_with_layout, grays))
+
+    def extract_text_with_layout(self, gray: np.ndarray) -> List[Dict]:
+        scale = min(1.0, self.MAX_OCR_EDGE / max(gray.shape[:2]))
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        if np.median(gray) < 128:
+            gray = cv2.bitwise_not(gray)
+
+        bw = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                   self.THRESHOLD_BLOCK_SIZE, self.THRESHOLD_OFFSET)
+        data = self._image_to_data(bw)
+        return self._build_text_blocks(data, 1.0 / scale)
+
+    def _image_to_data(self, bw: np.ndarray) -> Dict:
+        api = _tess_api()
+        height, width = bw.shape[:2]
+        api.SetImageBytes(bw.tobytes(), width, height, 1, width)
+        api.Recognize()
+
+        data = {key: [] for key in ('text', 'conf', 'left', 'top', 'height', 'block_num')}
+        ri = api.GetIterator()
+        if ri is None:
+            return data
+
+        block_num = 0
+        for word in iterate_level(ri, RIL.WORD):
+            if word.IsAtBeginningOf(RIL.BLOCK):
+                block_num += 1
+
+            conf = word.Confidence(RIL.WORD)
+            if conf <= self.CONFIDENCE_THRESHOLD:
+                continue
+
+            bbox = word.BoundingBox(RIL.WORD)
+            if bbox is None:
+                continue
+
+            text = (word.GetUTF8Text(RIL.WORD) or '').strip()
+            if not text:
+                continue
+
+            left, top, _, bottom = bbox
+            data['text'].append(text)
+            data['conf'].append(conf)
+            data['left'].append(left)
+            data['top'].append(top)
+            data['height'].append(bottom - top)
+            data['block_num'].append(block_num)
+
+        return data
+
+    def _build_text_blocks(self, words: Dict, scale: float = 1.0) -> List[Dict]:
+        texts = words['text']
+        if not texts:
+            return []
+
+        top = self._scaled(words['top'], scale)
+        block_num = np.asarray(words['block_num'])
+
+        starts = np.asarray(self._line_starts(top.tolist(), block_num.tolist()))
+        ends = np.append(starts[1:], len(texts))
+
+        lefts = self._scaled(np.asarray(words['left'])[starts], scale).tolist()
+        tops = top[starts].tolist()
+        heights = self._scaled(np.asarray(words['height'])[starts], scale).tolist()
+        confidences = np.asarray(words['conf'], dtype=float)[starts].tolist()
+        block_nums = block_num[starts].tolist()
 
         text_blocks = []
-        current_line = self._create_empty_line()
-
-        for i in range(len(data['text'])):
-            if int(data['conf'][i]) > self.CONFIDENCE_THRESHOLD:
-                text = data['text'][i].strip()
-                if text:
-                    if self._is_new_line(current_line, data, i):
-                        text_blocks.append(current_line.copy())
-                        current_line = self._create_line_from_data(data, i, text)
-                    else:
-                        self._append_to_current_line(current_line, data, i, text)
 
-        if current_line['text']:
-            text_blocks.append(current_line)
-
-        for block in text_blocks:
-            block['estimated_font_size'] = self.estimate_font_size(block['height'])
-            block['style'] = self.determine_style(block)
+        for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+            text = ' '.join(texts[start:end])
+            font_size = self.estimate_font_size(heights[i])
+            text_blocks.append({
+                'text': text,
+                'left': lefts[i],
+                'top': tops[i],
+                'height': heights[i],
+                'confidence': confidences[i],
+                'block_num': block_nums[i],
+                'estimated_font_size': font_size,
+                'style': self.determine_style(end - start, text.isupper(), font_size)
+            })
 
         return text_blocks
 
-    def _create_empty_line(self) -> Dict:
-        return {
-            'text': '',
-            'left': 0,
-            'top': 0,
-            'height': 0,
-            'confidence': 0,
-            'block_num': 0
-        }
+    def _line_starts(self, tops: List[int], block_nums: List[int]) -> List[int]:
+        starts = [0]
+        line_top = tops[0]
+        line_block = block_nums[0]
 
-    def _is_new_line(self, current_line: Dict, data: Dict, index: int) -> bool:
-        return (current_line['text'] and
-                (data['block_num'][index] != current_line['block_num'] or
-                 abs(data['top'][index] - current_line['top']) > 10))
-
-    def _create_line_from_data(self, data: Dict, index: int, text: str) -> Dict:
-        return {
-            'text': text,
-            'left': data['left'][index],
-            'top': data['top'][index],
-            'height': data['height'][index],
-            'confidence': data['conf'][index],
-            'block_num': data['block_num'][index]
-        }
+        for i in range(1, len(tops)):
+            if block_nums[i] != line_block or abs(tops[i] - line_top) > self.LINE_BREAK_THRESHOLD:
+                starts.append(i)
+                line_top = tops[i]
+                line_block = block_nums[i]
 
-    def _append_to_current_line(self, current_line: Dict, data: Dict, index: int, text: str) -> None:
-        if current_line['text']:
-            current_line['text'] += ' ' + text
-        else:
-            current_line['text'] = text
-            current_line['left'] = data['left'][index]
-            current_line['top'] = data['top'][index]
-            current_line['height'] = data['height'][index]
-            current_line['block_num'] = data['block_num'][index]
+        return starts
+
+    def _scaled(self, values: np.ndarray, scale: float) -> np.ndarray:
+        column = np.asarray(values)
+        if scale == 1.0:
+            return column
+        return np.rint(column * scale).astype(int)
 
     def estimate_font_size(self, height: int) -> int:
         return max(8, int(height * 0.8))
 
-    def determine_style(self, block: Dict) -> str:
-        font_size = block['estimated_font_size']
-        text = block['text']
-
-        is_all_caps = text.isupper() and len(text.split()) <= 15
-        is_short_standalone = len(text.split()) <= 6 and font_size >= 10
-
-        if is_all_caps and font_size < 14:
-            return 'header'
-        elif font_size >= self.font_size_thresholds['heading1']:
-            return 'heading1'
-        elif font_size >= self.font_size_thresholds['heading2'] or is_short_standalone:
-            return 'heading2'
-        elif font_size >= self.font_size_thresholds['heading3']:
-            return 'heading3'
+    def determine_style(self, word_count: int, is_upper: bool, font_size: int) -> int:
+        if is_upper and word_count <= 15 and font_size < 14:
+            return STYLE_HEADER
+        elif font_size >= self.H1:
+            return STYLE_HEADING1
+        elif font_size >= self.H2 or (word_count <= 6 and font_size >= 10):
+            return STYLE_HEADING2
+        elif font_size >= self.H3:
+            return STYLE_HEADING3
         else:
-            return 'body'
+            return STYLE_BODY
 
-    def create_word_document(self, text_blocks: List[Dict], output_path: str) -> None:
+    def create_word_document(self, text_blocks: List[Dict], output: Union[str, BinaryIO]) -> None:
         doc = Document()
         self._configure_document_style(doc)
 
+        style_ids = {
+            STYLE_BODY: doc.styles['S_Body'].style_id,
+            STYLE_HEADING1: doc.styles['Heading 1'].style_id,
+            STYLE_HEADING2: doc.styles['Heading 2'].style_id,
+            STYLE_HEADING3: doc.styles['Heading 3'].style_id,
+            STYLE_HEADER: doc.styles['S_Header'].style_id
+        }
+        sect_pr = doc.element.body.find(qn('w:sectPr'))
+
         last_top = 0
         last_block_num = -1
 
         for i, block in enumerate(text_blocks):
-            self._add_paragraph_to_document(doc, block, i, last_top, last_block_num)
+            self._add_paragraph_to_document(sect_pr, style_ids, block, i, last_top, last_block_num)
             last_top = block['top'] + block['height']
             last_block_num = block['block_num']
 
-        doc.save(output_path)
+        doc.save(output)
 
     def _configure_document_style(self, doc: Document) -> None:
         style = doc.styles['Normal']
         style.font.name = 'Calibri'
-        style.font.size = Pt(11)
+        style.font.size = _PT[11]
+
+        header = doc.styles.add_style('S_Header', WD_STYLE_TYPE.PARAGRAPH)
+        header.base_style = style
+        header.font.size = _PT[9]
+        header.font.color.rgb = _GREY
+        header.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        header.paragraph_format.space_after = _PT[6]
+
+        body = doc.styles.add_style('S_Body', WD_STYLE_TYPE.PARAGRAPH)
+        body.base_style = style
+        body.font.color.rgb = _BLACK
+        body.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
+        body.paragraph_format.space_before = _PT[0]
+        body.paragraph_format.space_after = _PT[0]
+        body.paragraph_format.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
+        body.paragraph_format.line_spacing = 1.15
+
+        for level, space_after in ((1, 8), (2, 6), (3, 4)):
+            heading = doc.styles[f'Heading {level}']
+            heading.font.bold = True
+            heading.font.name = 'Calibri'
+            heading.font.color.rgb = _BLACK
+            heading.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.LEFT
+            heading.paragraph_format.space_after = _PT[space_after]
 
         for section in doc.sections:
-            section.top_margin = Inches(0.8)
-            section.bottom_margin = Inches(0.8)
-            section.left_margin = Inches(1.0)
-            section.right_margin = Inches(1.0)
-
-    def _add_paragraph_to_document(self, doc: Document, block: Dict, index: int,
-                                   last_top: int, last_block_num: int) -> None:
+            section.top_margin = _MARGIN_VERTICAL
+            section.bottom_margin = _MARGIN_VERTICAL
+            section.left_margin = _MARGIN_HORIZONTAL
+            section.right_margin = _MARGIN_HORIZONTAL
+
+    def _add_paragraph_to_document(self, sect_pr: etree._Element, style_ids: Dict[int, str],
+                                   block: Dict, index: int, last_top: int,
+                                   last_block_num: int) -> None:
         if block.get('is_page_break', False):
-            doc.add_page_break()
+            p = etree.Element(_W_P)
+            etree.SubElement(etree.SubElement(p, _W_R), _W_BR, {_W_TYPE: 'page'})
+            sect_pr.addprevious(p)
 
-        text = block['text']
         style_type = block['style']
 
         spacing_pixels = block['top'] - last_top if last_top > 0 else 0
         spacing_before = max(0, int(spacing_pixels * 0.3))
         is_new_paragraph = spacing_pixels > 20 or block['block_num'] != last_block_num
 
-        if style_type == 'header':
-            p = doc.add_paragraph(text)
-            p.runs[0].font.size = Pt(9)
-            p.runs[0].font.color.rgb = RGBColor(150, 150, 150)
-            p.runs[0].font.name = 'Calibri'
-            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            p.paragraph_format.space_after = Pt(6)
-
-        elif style_type == 'heading1':
-            p = doc.add_heading(text, level=1)
-            p.runs[0].font.size = Pt(block['estimated_font_size'])
-            p.runs[0].font.bold = True
-            p.runs[0].font.name = 'Calibri'
-            p.runs[0].font.color.rgb = RGBColor(0, 0, 0)
-            p.paragraph_format.space_before = Pt(spacing_before)
-            p.paragraph_format.space_after = Pt(8)
-
-        elif style_type == 'heading2':
-            p = doc.add_heading(text, level=2)
-            p.runs[0].font.size = Pt(block['estimated_font_size'])
-            p.runs[0].font.bold = True
-            p.runs[0].font.name = 'Calibri'
-            p.runs[0].font.color.rgb = RGBColor(0, 0, 0)
-            p.paragraph_format.space_before = Pt(max(12, spacing_before))
-            p.paragraph_format.space_after = Pt(6)
-
-        elif style_type == 'heading3':
-            p = doc.add_heading(text, level=3)
-            p.runs[0].font.size = Pt(block['estimated_font_size'])
-            p.runs[0].font.bold = True
-            p.runs[0].font.name = 'Calibri'
-            p.runs[0].font.color.rgb = RGBColor(0, 0, 0)
-            p.paragraph_format.space_before = Pt(max(10, spacing_before))
-            p.paragraph_format.space_after = Pt(4)
-
-        else:
-            p = doc.add_paragraph(text)
-            p.runs[0].font.size = Pt(11)
-            p.runs[0].font.name = 'Calibri'
-            p.runs[0].font.color.rgb = RGBColor(0, 0, 0)
-
-            if is_new_paragraph and index > 0:
-                p.paragraph_format.space_before = Pt(max(8, spacing_before))
-            else:
-                p.paragraph_format.space_before = Pt(0)
-
-            p.paragraph_format.space_after = Pt(0)
-            p.paragraph_format.line_spacing_rule = WD_LINE_SPACING.MULTIPLE
-            p.paragraph_format.line_spacing = 1.15
-
-        if style_type != 'header':
-            p.alignment = WD_ALIGN_PARAGRAPH.LEFT
+        font_size = None
+        space_before = None
+
+        if style_type == STYLE_HEADING1:
+            font_size = block['estimated_font_size']
+            space_before = spacing_before
+        elif style_type == STYLE_HEADING2:
+            font_size = block['estimated_font_size']
+            space_before = max(12, spacing_before)
+        elif style_type == STYLE_HEADING3:
+            font_size = block['estimated_font_size']
+            space_before = max(10, spacing_before)
+        elif style_type == STYLE_BODY and is_new_paragraph and index > 0:
+            space_before = max(8, spacing_before)
+
+        p = etree.Element(_W_P)
+        p_pr = etree.SubElement(p, _W_PPR)
+        etree.SubElement(p_pr, _W_PSTYLE, {_W_VAL: style_ids[style_type]})
+        if space_before is not None:
+            etree.SubElement(p_pr, _W_SPACING, {_W_BEFORE: str(space_before * 20)})
+
+        r = etree.SubElement(p, _W_R)
+        if font_size is not None:
+            etree.SubElement(etree.SubElement(r, _W_RPR), _W_SZ, {_W_VAL: str(font_size * 2)})
+        etree.SubElement(r, _W_T).text = block['text']
+
+        sect_pr.addprevious(p)
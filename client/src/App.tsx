@@ -18,13 +18,22 @@ function App() {
   const [message, setMessage] = useState('')
   const [messageType, setMessageType] = useState<MessageType>('info')
   const [downloadUrl, setDownloadUrl] = useState('')
+  const [downloadName, setDownloadName] = useState('')
+
+  const resetDownload = () => {
+    if (downloadUrl) {
+      URL.revokeObjectURL(downloadUrl)
+    }
+    setDownloadUrl('')
+    setDownloadName('')
+  }
 
   const handleFileSelect = (event: React.ChangeEvent<HTMLInputElement>) => {
     const files = event.target.files
     if (files && files.length > 0) {
       setSelectedFiles(Array.from(files))
       setMessage('')
-      setDownloadUrl('')
+      resetDownload()
     }
   }
 
@@ -45,16 +54,27 @@ function App() {
     })
 
     try {
-      const response = await axios.post(`${API_URL}/process-screenshots`, formData)
-
-      if (response.data.success) {
-        setMessage(`Successfully processed ${response.data.processed_count} screenshot${response.data.processed_count > 1 ? 's' : ''}!`)
-        setMessageType('success')
-        setDownloadUrl(`${API_URL}${response.data.download_url}`)
-      }
+      const response = await axios.post<Blob>(`${API_URL}/process-screenshots`, formData, {
+        responseType: 'blob'
+      })
+
+      const processedCount = Number(response.headers['x-processed-count'])
+      resetDownload()
+      setMessage(`Successfully processed ${processedCount} screenshot${processedCount > 1 ? 's' : ''}!`)
+      setMessageType('success')
+      setDownloadUrl(URL.createObjectURL(response.data))
+      setDownloadName(`extracted_content_${response.headers['x-file-id']}.docx`)
     } catch (error) {
-      const axiosError = error as AxiosError<ApiErrorResponse>
-      const errorMessage = axiosError.response?.data?.detail || axiosError.message || 'An unexpected error occurred'
+      const axiosError = error as AxiosError<Blob>
+      let detail: string | undefined
+      if (axiosError.response?.data instanceof Blob) {
+        try {
+          detail = (JSON.parse(await axiosError.response.data.text()) as ApiErrorResponse).detail
+        } catch {
+          detail = undefined
+        }
+      }
+      const errorMessage = detail || axiosError.message || 'An unexpected error occurred'
       setMessage(`Error: ${errorMessage}`)
       setMessageType('danger')
     } finally {
@@ -132,7 +152,8 @@ function App() {
                   <div className="d-grid mt-3">
                     <Button
                       variant="outline-light"
-                      onClick={() => window.open(downloadUrl, '_blank')}
+                      href={downloadUrl}
+                      download={downloadName}
                       className="btn-outline-dark-theme"
                     >
                       Download Document